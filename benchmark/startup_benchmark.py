@@ -0,0 +1,57 @@
+#/usr/bin/python
+"""
+Startup-time benchmark of `src/structure_analyzer.py`
+
+Runs the subcommands that need no parsing (`--help`, `query`, `diff`) many times in fresh
+interpreters and reports the wall time per call, together with the cost of `import pygccxml`
+which these subcommands no longer pay.
+
+Usage:
+    python3 benchmark/startup_benchmark.py --repeat 50
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ANALYZER = os.path.join(ROOT, "src", "structure_analyzer.py")
+DEPENDENCE = os.path.join(ROOT, "example", "complex_data_structure_dependence.json")
+
+CASES = [
+    ("--help", [ANALYZER, "--help"]),
+    ("query", [ANALYZER, "query", "--cache", DEPENDENCE, "UserInfo"]),
+    ("diff", [ANALYZER, "diff", DEPENDENCE, DEPENDENCE]),
+    ("import pygccxml", ["-c", "import pygccxml.parser, pygccxml.declarations, pygccxml.utils"]),
+]
+
+
+def bench(cmd, repeat):
+    """
+    Run `python cmd` `repeat` times, return the list of wall times in ms, or None if it fails
+    """
+    res = []
+    for _ in range(repeat):
+        stime = time.perf_counter()
+        ret = subprocess.run([sys.executable] + cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        res.append((time.perf_counter() - stime) * 1000)
+        if ret.returncode != 0:
+            return None
+    return res
+
+
+if __name__ == "__main__":
+    args_parser = argparse.ArgumentParser(description='Benchmark the startup time of structure_analyzer.py')
+    args_parser.add_argument('--repeat', dest='repeat', type=int, default=20,
+                        help='the number of runs for each case')
+    args = args_parser.parse_args()
+
+    print(f"{'Case':<18}{'min (ms)':>10}{'median (ms)':>14}{'max (ms)':>10}")
+    for name, cmd in CASES:
+        times = bench(cmd, args.repeat)
+        if times == None:
+            print(f"{name:<18}{'failed (not installed?)':>34}")
+            continue
+        print(f"{name:<18}{min(times):>10.1f}{statistics.median(times):>14.1f}{max(times):>10.1f}")
@@ -1,13 +1,55 @@
 #/usr/bin/python
-from pygccxml import parser, declarations, utils
 import time
+import copy
+import threading
 import traceback
 import logging
 import json
+import os
+import re
+import sys
+from fnmatch import fnmatchcase
 from enum import Enum
 import argparse
 # from funcy import log_durations
 
+# pygccxml (and CastXML behind it) is only needed when a header is really parsed,
+# it is imported lazily by `load_pygccxml()`, so `--help`, `query` and `diff` start fast
+parser = declarations = utils = None
+
+SUBCOMMANDS = ("analyze", "query", "diff", "flatten")
+
+# columns of the flattened member-path export, see `flatten_members()`
+FLAT_COLUMNS = ["path", "type", "is_fundamental", "is_enum", "is_pointer", "is_container", "is_static", "is_bitfield", "byte_offset"]
+
+# fields of a member variable which describe its place in the parent class, not its type,
+# they are kept on the member record only and never stored in the shared type cache
+MEMBER_LAYOUT_KEYS = ["byte_offset", "is_static", "is_bitfield"]
+
+
+def load_pygccxml():
+    """
+    Import pygccxml on first use and bind `parser`, `declarations`, `utils` as module globals
+    """
+    global parser, declarations, utils
+    if declarations is None:
+        from pygccxml import parser as _parser, declarations as _declarations, utils as _utils
+        parser, declarations, utils = _parser, _declarations, _utils
+
+
+def get_peak_rss_mb():
+    """
+    Peak resident set size of the process in MB, `None` when not available on this platform
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KB on Linux
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+
 class CppStructClassAnalyzer:
     '''
     RepoAnalyzer is used to analyze the cpp struct or class
@@ -193,11 +235,32 @@ class CppStructClassAnalyzer:
         使用场景：
         - 当分析复杂的嵌套结构时，同一个类型可能被多次引用，例如： std::vector<UserInfo> 和 std::map<int, UserInfo> 都包含 UserInfo
         - 缓存可以避免对 UserInfo 进行重复的递归分析
+
+        内存预算：
+        - 设置 memory_budget（字节）后，已完成的缓存项按 LRU 顺序溢出到临时文件，访问时再加载回内存
+        - 空字典占位（正在分析中的类型）不会被溢出
+
+        线程安全：
+        - 所有操作都在 lock_ 保护下进行，可以被多个线程（多个分析请求）共享
+        - claim_type_cache() 原子地查询并认领类型，其它请求正在分析的类型会等待其完成，同一类型只分析一次
         """
 
-        def __init__(self):
-            """初始化缓存字典"""
-            self.type_detail_cache_ = {}  # 存储类型名 -> 分析结果的映射
+        def __init__(self, memory_budget=None):
+            """初始化缓存字典
+            Args:
+                memory_budget (int): 内存中缓存项的估算大小上限（字节），默认 None 表示不限制
+            """
+            self.type_detail_cache_ = {}  # 存储类型名 -> 分析结果的映射，有内存预算时只包含内存中的缓存项，按最近访问排序
+            self.memory_budget_ = memory_budget
+            self.memory_used_ = 0
+            self.keys_ = {}         # 有内存预算时，记录所有缓存项的插入顺序（包括已溢出的）
+            self.entry_size_ = {}   # 内存中已完成的缓存项 -> 估算大小（json 长度）
+            self.spilled_ = {}      # 已溢出的缓存项 -> (文件偏移, 长度)
+            self.spill_file_ = None
+            self.lock_ = threading.RLock()
+            self.done_ = threading.Condition(self.lock_)  # 有类型分析完成时通知等待的请求
+            self.owners_ = {}       # 正在分析中的类型 -> 负责分析的请求
+            self.waiting_ = {}      # 正在等待的请求 -> 等待的类型，用于检测请求之间的循环等待
 
         def add_type_cache(self, k, v):
             """
@@ -216,7 +279,21 @@ class CppStructClassAnalyzer:
                 return
             # 标准化类型名：去除前导的"::"，因为 "::Asset" 和 "Asset" 是同一个类型
             _k = k[2 if k[0 : 2] == "::" else 0:]
-            self.type_detail_cache_[_k] = v
+            with self.lock_:
+                if v and self.owners_.pop(_k, None) != None:
+                    self.done_.notify_all()
+                if self.memory_budget_ == None:
+                    self.type_detail_cache_[_k] = v
+                    return
+                self.keys_[_k] = None
+                self.spilled_.pop(_k, None)  # 覆盖写入，之前溢出的内容已过期
+                self.memory_used_ -= self.entry_size_.pop(_k, 0)
+                self.type_detail_cache_.pop(_k, None)
+                self.type_detail_cache_[_k] = v
+                if v:
+                    self.entry_size_[_k] = len(json.dumps(v))
+                    self.memory_used_ += self.entry_size_[_k]
+                    self._spill()
 
         def get_type_cache(self, k):
             """
@@ -233,32 +310,304 @@ class CppStructClassAnalyzer:
                 return None
             # 同样进行类型名标准化
             _k = k[2 if k[0 : 2] == "::" else 0 : ]
-            res = self.type_detail_cache_.get(_k, None)
-            return res
+            with self.lock_:
+                res = self.type_detail_cache_.get(_k, None)
+                if self.memory_budget_ == None:
+                    return res
+                if res != None:
+                    # LRU：移到最近访问的位置
+                    self.type_detail_cache_[_k] = self.type_detail_cache_.pop(_k)
+                elif _k in self.spilled_:
+                    # 从磁盘加载回内存，磁盘上的内容保持有效，再次溢出时无需重写
+                    res = self._load(_k)
+                    self.type_detail_cache_[_k] = res
+                    self.entry_size_[_k] = self.spilled_[_k][1]
+                    self.memory_used_ += self.entry_size_[_k]
+                    self._spill()
+                return res
+
+        def claim_type_cache(self, k, owner):
+            """
+            查询类型缓存，未命中时插入空字典占位并由 owner 负责分析
+            Args:
+                k (str): 类型名称
+                owner: 发起查询的分析请求
+            Returns:
+                str: "New" 未命中，owner 需要分析并调用 add_type_cache 写入结果
+                     "InProcess" 类型正在被 owner 自身分析（递归类型），或者等待会形成请求之间的循环等待，
+                                 后者的引用会保留在缓存的结果中，哪个请求得到它取决于时序
+                     "Done" 已经分析完成
+            功能：
+                - 其它请求正在分析该类型时等待其完成，合并对同一类型的并发分析
+                - 只判断状态，不读取结果，已溢出到磁盘的类型不会被加载回内存
+            """
+            _k = k[2 if k[0 : 2] == "::" else 0 : ]
+            with self.lock_:
+                while True:
+                    if _k in self.spilled_:
+                        # 只有分析完成的类型才会溢出
+                        return "Done"
+                    res = self.type_detail_cache_.get(_k, None)
+                    if res == None:
+                        self.add_type_cache(k, {})
+                        self.owners_[_k] = owner
+                        return "New"
+                    if res != {}:
+                        return "Done"
+                    holder = self.owners_.get(_k, None)
+                    if holder == None or holder is owner or self._is_waiting_for(holder, owner):
+                        return "InProcess"
+                    self.waiting_[owner] = _k
+                    self.done_.wait()
+                    self.waiting_.pop(owner, None)
+
+        def release_owner(self, owner):
+            """请求结束（包括异常退出）时释放它仍占有的类型，并删除这些类型的占位，之后的请求会重新分析它们"""
+            with self.lock_:
+                keys = [_k for _k, o in self.owners_.items() if o is owner]
+                for _k in keys:
+                    self.owners_.pop(_k)
+                    if self.type_detail_cache_.get(_k, None) == {}:
+                        self.remove_type_cache(_k)
+                if keys:
+                    self.done_.notify_all()
+
+        def _is_waiting_for(self, holder, owner):
+            """holder 是否直接或间接地在等待 owner 占有的类型"""
+            seen = set()
+            while holder in self.waiting_ and id(holder) not in seen:
+                seen.add(id(holder))
+                holder = self.owners_.get(self.waiting_[holder], None)
+                if holder is owner:
+                    return True
+            return False
 
         def remove_type_cache(self, k):
             """移除类型缓存，注意：这里直接使用原始键名，没有进行标准化处理，可能需要根据实际使用情况调整
             """
-            _ = self.type_detail_cache_.pop(k, None)
+            with self.lock_:
+                _ = self.type_detail_cache_.pop(k, None)
+                self.keys_.pop(k, None)
+                self.spilled_.pop(k, None)
+                self.memory_used_ -= self.entry_size_.pop(k, 0)
+
+        def cache_count(self):
+            """缓存项数量（包括已溢出到磁盘的）"""
+            with self.lock_:
+                return len(self.type_detail_cache_) if self.memory_budget_ == None else len(self.keys_)
+
+        def _spill(self):
+            """内存超出预算时，把最久未访问的已完成缓存项写入临时文件，至少保留最近的一项"""
+            while self.memory_used_ > self.memory_budget_ and len(self.entry_size_) > 1:
+                for _k in self.type_detail_cache_:
+                    if _k in self.entry_size_:
+                        break
+                v = self.type_detail_cache_.pop(_k)
+                self.memory_used_ -= self.entry_size_.pop(_k)
+                if _k in self.spilled_:
+                    continue
+                if self.spill_file_ == None:
+                    import tempfile
+                    self.spill_file_ = tempfile.TemporaryFile(mode="w+b")
+                data = json.dumps(v).encode("utf-8")
+                self.spill_file_.seek(0, 2)
+                self.spilled_[_k] = (self.spill_file_.tell(), len(data))
+                self.spill_file_.write(data)
+                logging.debug("spill type {} to disk, {} bytes".format(_k, len(data)))
+
+        def _load(self, _k):
+            """从临时文件读取已溢出的缓存项"""
+            offset, length = self.spilled_[_k]
+            self.spill_file_.seek(offset)
+            return json.loads(self.spill_file_.read(length).decode("utf-8"))
+
+        def _peek(self, _k):
+            """读取缓存项但不改变 LRU 顺序，也不加载回内存，用于导出"""
+            with self.lock_:
+                res = self.type_detail_cache_.get(_k, None)
+                if res == None and _k in self.spilled_:
+                    res = self._load(_k)
+                return res
+
+        def dump_inflated(self, v, w, level=0, sort_keys=False):
+            """
+            按 json.dump(indent=4) 的格式逐项写出 v，`cached: Detached` 引用从缓存取出完整子树展开写出
+            有内存预算时结果中的子树只以引用形式保存在内存里，写文件时展开，输出格式与没有内存预算时相同
+            Args:
+                v: 要写出的结果
+                w: 文件对象
+                level (int): 当前缩进层级
+                sort_keys (bool): 是否按键排序
+            """
+            indent = "    "
+            if isinstance(v, dict) and v.get("cached") == "Detached":
+                entry = self._peek(v["cache_k"][2 if v["cache_k"][0 : 2] == "::" else 0 : ])
+                if entry:
+                    # 成员在父类中的布局只保存在引用里
+                    entry = dict(entry)
+                    for key in MEMBER_LAYOUT_KEYS:
+                        if key in v:
+                            entry[key] = v[key]
+                    v = entry
+            if isinstance(v, dict) or isinstance(v, list):
+                if not v:
+                    w.write("{}" if isinstance(v, dict) else "[]")
+                    return
+                if isinstance(v, dict):
+                    items = [(k, v[k]) for k in (sorted(v) if sort_keys else v)]
+                    w.write("{")
+                else:
+                    items = [(None, t) for t in v]
+                    w.write("[")
+                for i, (k, t) in enumerate(items):
+                    w.write("{}\n{}".format("," if i else "", indent * (level + 1)))
+                    if k != None:
+                        w.write("{}: ".format(json.dumps(k)))
+                    self.dump_inflated(t, w, level + 1, sort_keys)
+                w.write("\n{}{}".format(indent * level, "}" if isinstance(v, dict) else "]"))
+                return
+            w.write(json.dumps(v))
 
-        def save_cache_info(self, output=None):
+        def save_cache_info(self, output=None, sort_keys=True):
             """保存数据信息到文件，作为所有依赖的类型分析结果
+            有内存预算时逐项写出并展开子树引用，已溢出的缓存项不会全部加载回内存，输出与没有内存预算时相同
             """
-            if output != None:
-                with open(output, "w") as w:
-                    json.dump(self.type_detail_cache_, w, indent=4, sort_keys=True)
+            if output == None:
+                return
+            with self.lock_, open(output, "w") as w:
+                if self.memory_budget_ == None:
+                    json.dump(self.type_detail_cache_, w, indent=4, sort_keys=sort_keys)
+                    return
+                keys = sorted(self.keys_) if sort_keys else list(self.keys_)
+                w.write("{")
+                for i, _k in enumerate(keys):
+                    w.write("{}\n    {}: ".format("," if i else "", json.dumps(_k)))
+                    self.dump_inflated(self._peek(_k), w, 1, sort_keys)
+                w.write("\n}" if keys else "}")
+
+        def load_cache_info(self, input):
+            """从文件加载之前保存的分析结果，无需重新解析头文件
+            支持 `_dependence.json`（类型名 -> 分析结果）和 `_analyze.json`（根类型的单个分析结果）
+            """
+            with open(input, "r") as f:
+                data = json.load(f)
+            if "type" in data and "decl_type" in data:
+                self.add_type_cache(data["type"], data)
+            else:
+                for k, v in data.items():
+                    self.add_type_cache(k, v)
     
-    def __init__(self, only_public_var=True ,file_path_black_list=[]):
+    class TypeFilter:
+        """
+        类型过滤器
+
+        作用：
+        1. 统一管理需要跳过的命名空间、类型名和声明所在的文件路径
+        2. 每个类型名 / 文件路径的判断结果只计算一次（缓存）
+        3. 解析完成后直接从声明树中剪掉被跳过的命名空间和类，后续的查找不再遍历这些子树
+
+        规则：
+        - skip_namespaces: 命名空间 glob，例如 "std"、"boost"、"absl"，类型名中任意一级命名空间限定符匹配即跳过，
+                           例如 "std" 会跳过 "std::vector<int>" 和 "Foo<std::string>"
+                           规则匹配的是完整的命名空间名（从最外层开始），例如 "absl" 会跳过 "absl::Bar"，
+                           而 "absl::*" 只匹配 "absl::x" 这样的嵌套命名空间，不会跳过 "absl::Bar"
+        - skip_types: 类型名 glob，对完整类型名匹配，例如 "*_impl"
+        - skip_files: 声明所在文件路径，包含 glob 字符（*?[）时按 glob 匹配，否则按子串匹配，例如 "3rd"、"/usr/*"
+        """
+
+        # 这些命名空间在所有查找中都会被跳过：类、枚举和 typedef
+        # 注意 mstd 也会跳过枚举和 typedef 的查找，例如模板参数中的 mstd:: 枚举不会再被识别为枚举
+        DEFAULT_SKIP_NAMESPACES = ["std", "tsl", "mstd"]
+        NAMESPACE_QUALIFIER_RE = re.compile(r"(?<![\w:])(?:::)?((?:\w+::)+)")
+
+        def __init__(self, skip_namespaces=None, skip_types=None, skip_files=None):
+            """
+            Args:
+                skip_namespaces (list): 额外跳过的命名空间，默认跳过 DEFAULT_SKIP_NAMESPACES
+                skip_types (list): 跳过的类型名
+                skip_files (list): 跳过的声明文件路径
+            """
+            self.skip_namespaces_ = self.DEFAULT_SKIP_NAMESPACES + list(skip_namespaces or [])
+            self.skip_types_ = list(skip_types or [])
+            self.skip_files_ = list(skip_files or [])
+            self.type_decisions_ = {}  # 类型名 -> 是否跳过
+            self.file_decisions_ = {}  # 文件路径 -> 是否跳过
+
+        def is_namespace_skipped(self, ns):
+            """ns: 完整的命名空间名，例如 "boost::container"，不带前导::"""
+            return any(fnmatchcase(ns, p) for p in self.skip_namespaces_)
+
+        def is_type_skipped(self, type_str):
+            """检查类型名中的每一级命名空间限定符和完整类型名"""
+            res = self.type_decisions_.get(type_str, None)
+            if res != None:
+                return res
+            res = any(fnmatchcase(type_str, p) for p in self.skip_types_)
+            if not res:
+                for qualifier in self.NAMESPACE_QUALIFIER_RE.findall(type_str):
+                    scopes = qualifier.split("::")[:-1]
+                    if any(self.is_namespace_skipped("::".join(scopes[:i + 1])) for i in range(len(scopes))):
+                        res = True
+                        break
+            self.type_decisions_[type_str] = res
+            return res
+
+        def is_file_skipped(self, file_name):
+            res = self.file_decisions_.get(file_name, None)
+            if res == None:
+                res = any(fnmatchcase(file_name, p) if any(c in p for c in "*?[") else p in file_name for p in self.skip_files_)
+                self.file_decisions_[file_name] = res
+            return res
+
+        def prune(self, scope, prefix=""):
+            """
+            从声明树中移除被跳过的命名空间，以及声明在被跳过文件中的类
+            被移除的声明仍然被成员变量的类型引用，类型判断（is_class 等）不受影响
+            typedef 在剪枝之前已经建立索引（index_typedefs），typedef 的解析结果不受影响，
+            例如 `typedef std::string MyStr` 仍然解析为 `std::basic_string<char>`
+            Returns:
+                int: 移除的声明数量
+            """
+            removed = 0
+            for decl in list(scope.declarations):
+                if isinstance(decl, declarations.namespace_t):
+                    ns = prefix + decl.name
+                    if self.is_namespace_skipped(ns):
+                        scope.remove_declaration(decl)
+                        removed += 1
+                    else:
+                        removed += self.prune(decl, ns + "::")
+                elif isinstance(decl, declarations.class_t) and decl.location != None \
+                        and self.is_file_skipped(decl.location.file_name):
+                    scope.remove_declaration(decl)
+                    removed += 1
+            return removed
+
+    def __init__(self, only_public_var=True ,file_path_black_list=[], memory_budget=None, drop_decls=False,
+                 skip_namespaces=None, skip_types=None):
         '''
         @file: the file needed to be analyzed, default `None`
         @cflags: shell flags for clang++, default `None`
         @only_public_var: default `True`, will only analyze the public variables of a class/struct
         @file_path_black_list: default `[]`, the class which is declaration under the paths will be ignore
+        @memory_budget: default `None`, the budget (bytes) of the type cache, finished cold entries are spilled to disk,
+                        nested types in the in-memory result are kept as `cached: Detached` references,
+                        they are expanded again when the json files are written
+        @drop_decls: default `False`, release the member declarations of each class as soon as it is analyzed,
+                     and the whole pygccxml declaration tree after the analysis, before writing the outputs
+        @skip_namespaces: default `None`, the namespaces (glob) skipped besides `TypeFilter.DEFAULT_SKIP_NAMESPACES`
+        @skip_types: default `None`, the type names (glob) which will be skipped
         '''
+        load_pygccxml()
         self.only_public_var_ = only_public_var
-        self.filepath_black_list_ = file_path_black_list
-        self.cache_ = CppStructClassAnalyzer.TypeDetailCache()
+        self.filter_ = CppStructClassAnalyzer.TypeFilter(skip_namespaces, skip_types, file_path_black_list)
+        self.cache_ = CppStructClassAnalyzer.TypeDetailCache(memory_budget)
+        self.drop_decls_ = drop_decls
+        self.released_classes_ = {}  # full name of the classes released by `drop_decls` -> [(name, decl_type, layout)]
         self.global_ns_ = None
+        self.typedefs_ = None  # typedef name -> first typedef of the whole tree, see `index_typedefs`
+        self.parse_lock_ = threading.Lock()
+        self.parsed_header_ = None  # (file, cflags) of the parsed namespace
         self.find_class_cost = 0
         self.not_find_class_cost = 0
         self.find_typedef_cost = 0
@@ -266,22 +615,19 @@ class CppStructClassAnalyzer:
         # self.analyzed_typedef_string = {}  # for debug
 
     def _get_cache(self, k):
-        res = self.cache_.get_type_cache(k)
-        logging.debug("{}get type {} from cache".format("" if res != None else "cannot ", k))
-        if res == None:
-            self.cache_.add_type_cache(k, {})
+        state = self.cache_.claim_type_cache(k, self)
+        logging.debug("{}get type {} from cache".format("" if state != "New" else "cannot ", k))
+        if state == "New":
             return False, None
-        elif res == {}:
-            res["cached"] = "InProcess"
-            res["cache_k"] = k
-            return True, res
-        else:
-            t = {"cached": "Done", "cache_k": k}
-            return True, t
+        return True, {"cached": state, "cache_k": k}
     
     # @log_durations(logging.debug)
     def parse_global_namespace(self, file, cflags): 
-        if self.global_ns_ == None:
+        with self.parse_lock_:
+            if self.parsed_header_ == None:
+                self.parsed_header_ = (file, cflags)
+            if self.global_ns_ != None:
+                return
             generator_path, generator_name = utils.find_xml_generator('castxml')
             config = parser.xml_generator_configuration_t(
                 xml_generator_path = generator_path,
@@ -292,6 +638,67 @@ class CppStructClassAnalyzer:
             logging.info("Start parsing... {}".format(time.ctime(time.time())))
             decls = parser.parse([file], config, parser.COMPILATION_MODE.ALL_AT_ONCE)
             self.global_ns_ = declarations.get_global_namespace(decls)
+            self.index_typedefs()
+            logging.info("pruned {} skipped declarations".format(self.filter_.prune(self.global_ns_)))
+
+    def index_typedefs(self):
+        '''
+        index the typedefs by name before the skipped namespaces are pruned, so `find_typedef` still resolves
+        through them (e.g. `std::string` -> `std::basic_string<char>`), the first one in the order of
+        `scopedef_t.typedefs()` is kept
+        '''
+        self.typedefs_ = {}
+        for decl in declarations.make_flatten(self.global_ns_):
+            if isinstance(decl, declarations.typedef_t):
+                self.typedefs_.setdefault(decl.name, decl)
+
+    def release_global_namespace(self):
+        '''
+        drop the pygccxml declarations once the whole analysis is finished, the results only hold strings
+        so they stay valid, the next `start_analyze` will parse the file again
+        '''
+        if self.global_ns_ != None:
+            import gc
+            self.global_ns_ = None
+            self.parsed_header_ = None
+            self.typedefs_ = None
+            self.released_classes_ = {}
+            gc.collect()  # declarations reference their parents, free the cycles now
+            logging.info("pygccxml declarations released, peak RSS so far: {} MB".format(get_peak_rss_mb()))
+
+    def release_class_declarations(self, cls, cls_name, variables):
+        '''
+        with `drop_decls`, free the members of an analyzed class during the walk instead of at the end:
+        variables and functions are dropped, nested classes / enums / typedefs are kept for the later lookups,
+        the class is removed from its scope once it is empty.
+        The name, type and layout of the analyzed members are kept, under the full name and `cls_name`,
+        for the later lookups of this class by another type string (e.g. through a typedef)
+        '''
+        name = declarations.full_name(cls)[2:]
+        if name in self.released_classes_:
+            return
+        members = [(r["name"], r["decl_type"], {k: r[k] for k in MEMBER_LAYOUT_KEYS if k in r}) for r in variables]
+        self.released_classes_[name] = members
+        self.released_classes_.setdefault(cls_name[2 if cls_name[0 : 2] == "::" else 0 : ], members)
+        keep = (declarations.scopedef_t, declarations.typedef_t, declarations.enumeration_t)
+        cls.public_members = [d for d in cls.public_members if isinstance(d, keep)]
+        cls.protected_members = [d for d in cls.protected_members if isinstance(d, keep)]
+        cls.private_members = [d for d in cls.private_members if isinstance(d, keep)]
+        if not cls.declarations and cls.parent != None:
+            cls.parent.remove_declaration(cls)
+
+    def _detach(self, k, res):
+        '''
+        with a memory budget the finished subtree is only kept in the cache (which may spill it to disk),
+        the parent holds a `cached: Detached` reference, `TypeDetailCache.dump_inflated` expands it when writing
+        '''
+        if self.cache_.memory_budget_ == None or res == None:
+            return res
+        t = {"cached": "Detached", "cache_k": k}
+        for key in ["type", "decl_type", "name"] + MEMBER_LAYOUT_KEYS:
+            if key in res:
+                t[key] = res[key]
+        return t
     
     # @log_durations(logging.debug)
     def start_analyze(self, file, cflags, cls, output=None, sort_keys=False):
@@ -303,7 +710,12 @@ class CppStructClassAnalyzer:
         self.file_ = file
         self.cflags_ = cflags
         self.parse_global_namespace(self.file_, self.cflags_)
-        self.res = self.analyze_string(cls)
+        try:
+            self.res = self._analyze_root(cls)
+        finally:
+            self.cache_.release_owner(self)
+        if self.drop_decls_:
+            self.release_global_namespace()
         logging.debug("result for {}: \n{}".format(cls, json.dumps(self.res, indent=4)))
         # logging.debug("analyzed_typedef_string: {}".format(json.dumps(self.analyzed_typedef_string, indent=4, sort_keys=True)))
         logging.debug("find_class_cost: {}ms\nnot_find_class_cost: {}msn\nfind_typedef_time: {}ms\nfind_enum_cost: {}ms".format(
@@ -313,10 +725,79 @@ class CppStructClassAnalyzer:
             int(self.find_enum_cost*1000))) 
         if output:
             with open(output, "w") as f:
-                json.dump(self.res, f, indent=4, sort_keys=sort_keys)
-            with open(output[:-5]+"_dependence.json", "w") as f:
-                json.dump(self.cache_.type_detail_cache_, f, indent=4, sort_keys=sort_keys)
+                if self.cache_.memory_budget_ == None:
+                    json.dump(self.res, f, indent=4, sort_keys=sort_keys)
+                else:
+                    self.cache_.dump_inflated(self.res, f, 0, sort_keys)
+            self.cache_.save_cache_info(output[:-5]+"_dependence.json", sort_keys=sort_keys)
     
+    def analyze(self, file, cflags, cls):
+        '''
+        reentrant version of `start_analyze`, can be called from several threads on the same analyzer,
+        which keeps only one parsed namespace and one type cache for all of them
+            @cls: str, name of the class/struct which needed be analyzed
+            @return (dict, dict): the result of `cls` (a copy owned by the caller), and the lookup costs (seconds)
+                                  of this request
+        the file is parsed by the first call only, later calls must pass the same `file` and `cflags`,
+        otherwise `ValueError` is raised; `drop_decls` is ignored here, the declarations are shared by the requests.
+        Nested types analyzed before are `cached` references, see `resolve`. When two requests need each other's
+        types (A -> B and B -> A), one of them gets an `InProcess` reference instead of waiting, which one depends
+        on the timing; the reference stays in the cached type, `resolve` gives the full type once both are done
+        '''
+        self.parse_global_namespace(file, cflags)
+        if self.parsed_header_ != (file, cflags):
+            raise ValueError("analyzer is bound to {} with cflags `{}`, cannot analyze {} with cflags `{}`".format(
+                self.parsed_header_[0], self.parsed_header_[1], file, cflags))
+        # the request shares the namespace, the filter and the cache, the costs and the result are its own
+        request = copy.copy(self)
+        request.file_ = file
+        request.cflags_ = cflags
+        request.find_class_cost = 0
+        request.not_find_class_cost = 0
+        request.find_typedef_cost = 0
+        request.find_enum_cost = 0
+        request.drop_decls_ = False
+        try:
+            res = request._analyze_root(cls)
+        finally:
+            self.cache_.release_owner(request)
+        costs = {
+            "find_class_cost": request.find_class_cost,
+            "not_find_class_cost": request.not_find_class_cost,
+            "find_typedef_cost": request.find_typedef_cost,
+            "find_enum_cost": request.find_enum_cost
+        }
+        # the result is the cached entry shared with the other requests
+        return copy.deepcopy(res), costs
+
+    def resolve(self, ref):
+        '''
+        resolve a `cached` reference (`Done`, `Detached`, or `InProcess` once its type is finished) of a result
+            @ref: dict, a type or a member of a result
+            @return dict, a copy of the analyzed type, with the `name` and the layout of the member `ref`;
+                    `ref` itself when it is not a reference, `None` when its type is not finished yet
+        the nested types of the returned type may be references too
+        '''
+        if ref == None or ref.get("cached") == None:
+            return ref
+        entry = self.cache_.get_type_cache(ref["cache_k"])
+        if not entry:
+            return None
+        res = copy.deepcopy(entry)
+        # the entry is shared by all members of the type, the name and the layout belong to `ref`
+        for key in ["name"] + MEMBER_LAYOUT_KEYS:
+            if key in ref:
+                res[key] = ref[key]
+        return res
+
+    def _analyze_root(self, cls):
+        res = self.analyze_string(cls)
+        if res != None and res.get("cached") != None:
+            # the root was analyzed before (or by a concurrent request, or is detached with a memory budget),
+            # take the full result back from the cache
+            res = self.cache_.get_type_cache(cls) or res
+        return res
+
     def pre_process_type_string(self, type_str):    
         """
             pre-process: remove const, deal with prefix '::'
@@ -335,10 +816,10 @@ class CppStructClassAnalyzer:
         if type_str.startswith("unsigned"): type_str = type_str[8:].strip()
         return type_str in self.FUNDAMENTAL_LIST
     
-    def is_string_enum(self, type_str, black_list=["std::", "*", "tsl::", "<"]):
-        for t in black_list:
-            if t in type_str:
-                return None
+    def is_string_enum(self, type_str):
+        # pointers and template instances are never enums
+        if "*" in type_str or "<" in type_str or self.filter_.is_type_skipped(type_str):
+            return None
         _type = type_str.split("::")[-1]
         try:
             stime = time.time()
@@ -385,7 +866,7 @@ class CppStructClassAnalyzer:
                     t = self.analyze_string_class(_type)
                     res.update(t)
         self.cache_.add_type_cache(type_str, res)
-        return res
+        return self._detach(type_str, res)
     
     def analyze_string_pointer(self, type_str):
         res = {}
@@ -398,6 +879,13 @@ class CppStructClassAnalyzer:
 
     def analyze_string_class(self, cls_name):
         res = {}
+        released = self.released_classes_.get(cls_name[2 if cls_name[0 : 2] == "::" else 0 : ], None)
+        if released != None:
+            # the member types of a released class are all in the cache, same references as analyzing it again
+            return {
+                "variables": [self._get_cached_var(*member) for member in released],
+                "is_class": True
+            }
         cls = self.find_class(cls_name)
         if cls != None:
             res = {
@@ -413,6 +901,8 @@ class CppStructClassAnalyzer:
                     r = self.analyze_var(var, str(cls.name))
                     if r != None:
                         res["variables"].append(r)
+            if self.drop_decls_:
+                self.release_class_declarations(cls, cls_name, res["variables"])
         return res
                
     def analyze_string_container(self, type_str):
@@ -434,11 +924,10 @@ class CppStructClassAnalyzer:
             res["container_v"] = t
         return res
 
-    def analyze_string_typedef(self, type_str, black_list=["std::", "*", "tsl::"]):
+    def analyze_string_typedef(self, type_str):
         # self.analyzed_typedef_string.update({type_str:{}})
-        for t in black_list:
-            if t in type_str:
-                return {}
+        if "*" in type_str or self.filter_.is_type_skipped(type_str):
+            return {}
         type = self.find_typedef(type_str)
         res = {}
         if type != None:
@@ -455,9 +944,9 @@ class CppStructClassAnalyzer:
         '''
         if self.filter_var(var, parent_name):
             return None
-        ret, t = self._get_cache(str(var.decl_type))
-        if ret:
-            t.update({"name": str(var.name), "decl_type": str(var.decl_type)})
+        layout = self.get_var_layout(var)
+        t = self._get_cached_var(str(var.name), str(var.decl_type), layout)
+        if t != None:
             return t
         res = self.analyze_var_common(var)
         
@@ -488,8 +977,21 @@ class CppStructClassAnalyzer:
             res["is_unknown"] = True
         if res != None:
             self.cache_.add_type_cache(str(var.decl_type), res)
-        return res
+            # the layout belongs to this member, the cache entry is shared by all members of this type
+            res = dict(res, **layout)
+        return self._detach(str(var.decl_type), res)
     
+    def _get_cached_var(self, name, decl_type, layout):
+        '''
+        @return dict, the `cached` reference of a member whose type is in the cache, `None` when it has to be analyzed
+        '''
+        ret, t = self._get_cache(decl_type)
+        if not ret:
+            return None
+        t.update({"name": name, "decl_type": decl_type})
+        t.update(layout)
+        return t
+
     def filter_var(self, var, parent_name):
         if self.only_public_var_ and str(var.access_type) != "public":
             return True
@@ -509,10 +1011,24 @@ class CppStructClassAnalyzer:
         res["type"] = _type
         return res
        
+    def get_var_layout(self, var):
+        '''
+        @return dict, the place of the member inside its class (keys of `MEMBER_LAYOUT_KEYS`):
+                `is_static` for static members which are not part of the object, `is_bitfield` for bit fields
+                whose byte offset is not exact, `byte_offset` otherwise
+        '''
+        if var.type_qualifiers.has_static:
+            return {"is_static": True}
+        if var.bits:
+            return {"is_bitfield": True}
+        return {"byte_offset": int(var.byte_offset)}
+
     def find_typedef(self, custom_type, depth=2):
         '''
         @depth: int, the number of the iterations to find the multi-typedef
         '''
+        if self.typedefs_ == None:
+            self.index_typedefs()
         cnt = 0
         res = None
         while cnt < depth:
@@ -520,22 +1036,19 @@ class CppStructClassAnalyzer:
                 break
             stime = time.time()
             _type = custom_type.split("::")[-1]
-            try:
-                res = self.global_ns_.typedefs(_type)[0]
-                self.find_typedef_cost += time.time() - stime
-                custom_type = str(res.decl_type)
-            except RuntimeError as e:
-                self.find_typedef_cost += time.time() - stime
-                logging.debug("cannot get typedef for {}, {}".format(custom_type, str(e)))
+            t = self.typedefs_.get(_type, None)
+            self.find_typedef_cost += time.time() - stime
+            cnt += 1
+            if t == None:
+                logging.debug("cannot get typedef for {}".format(custom_type))
                 break
-            finally: 
-                cnt += 1
+            res = t
+            custom_type = str(res.decl_type)
         return res
 
-    def find_class(self, cls_name, black_list = ["std::", "tsl::", "mstd::"]):
-        for t in black_list:
-            if t in cls_name:
-                return None
+    def find_class(self, cls_name):
+        if self.filter_.is_type_skipped(cls_name):
+            return None
         try:
             stime = time.time()
             l = cls_name.split("::")
@@ -556,8 +1069,9 @@ class CppStructClassAnalyzer:
                     except:
                         raise
             self.find_class_cost += time.time() - stime
-            if True in [a in cls.location.file_name for a in self.filepath_black_list_]:
-                logging.debug("cls {} in filepath_black_list_, location: {}".format(cls_name, str(cls.location.file_name)))
+            # classes in skipped files are pruned after parsing, nested ones may still be found here
+            if cls.location != None and self.filter_.is_file_skipped(cls.location.file_name):
+                logging.debug("cls {} in skipped files, location: {}".format(cls_name, str(cls.location.file_name)))
                 return None
         except Exception:
             self.not_find_class_cost += time.time() - stime
@@ -621,6 +1135,8 @@ def print_analysis_summary(analyzer, args, total_time):
     print(f"📁 {'Input File':<15}: {args.input}")
     print(f"🏗️  {'Analyzed Class':<15}: {args.cls}")
     print(f"📄 {'Output File':<15}: {args.output}")
+    if getattr(args, 'flat_output', None):
+        print(f"📄 {'Flat Output':<15}: {args.flat_output}")
     print(f"⏱️  {'Total Time':<15}: {total_time:.3f} seconds")
     print(f"📝 {'Log File':<15}: {args.log_file}")
 
@@ -628,9 +1144,16 @@ def print_analysis_summary(analyzer, args, total_time):
     print(f"\n⚙️  Analysis Configuration:")
     print(f"   • {'Public Members Only':<25}: {'Yes' if args.only_public_var else 'No'}")
     print(f"   • {'Sort JSON Keys':<25}: {'Yes' if args.sort_keys else 'No'}")
+    if getattr(args, 'memory_budget', None) != None:
+        print(f"   • {'Memory Budget':<25}: {args.memory_budget} MB")
+    if getattr(args, 'drop_decls', False):
+        print(f"   • {'Drop Declarations':<25}: Yes")
     print(f"   • {'Compiler Flags':<25}: {args.cflags}")
     if args.file_path_black_list:
         print(f"   • {'Blacklisted Paths':<25}: {', '.join(args.file_path_black_list)}")
+    print(f"   • {'Skipped Namespaces':<25}: {', '.join(analyzer.filter_.skip_namespaces_)}")
+    if args.skip_types:
+        print(f"   • {'Skipped Types':<25}: {', '.join(args.skip_types)}")
 
     # Performance statistics
     if hasattr(analyzer, 'find_class_cost') and hasattr(analyzer, 'find_typedef_cost'):
@@ -642,10 +1165,16 @@ def print_analysis_summary(analyzer, args, total_time):
 
     # Cache statistics
     if hasattr(analyzer, 'cache_') and analyzer.cache_:
-        cache_size = len(analyzer.cache_.type_detail_cache_)
+        cache_size = analyzer.cache_.cache_count()
         print(f"   • {'Type Cache Count':<25}: {cache_size} entries")
         if cache_size > 0:
             print(f"   • {'Cache Hit Rate':<25}: Improved analysis efficiency")
+        if analyzer.cache_.memory_budget_ != None:
+            print(f"   • {'Cache Memory Budget':<25}: {analyzer.cache_.memory_budget_ // 1024} KB")
+            print(f"   • {'Spilled Cache Entries':<25}: {len(analyzer.cache_.spilled_)} entries")
+
+    # Memory statistics
+    print(f"   • {'Peak RSS':<25}: {get_peak_rss_mb()} MB")
 
     # Analysis results statistics
     if hasattr(analyzer, 'res') and analyzer.res:
@@ -672,7 +1201,8 @@ def print_analysis_summary(analyzer, args, total_time):
 
         # Member variables statistics
         if 'variables' in result and isinstance(result['variables'], list):
-            variables = result['variables']
+            # with a memory budget the members are `cached` references, resolve them from the cache
+            variables = [analyzer.resolve(v) or v for v in result['variables']]
             var_count = len(variables)
             print(f"   • Total Member Variables: {var_count}")
 
@@ -704,30 +1234,179 @@ def print_analysis_summary(analyzer, args, total_time):
     # 结束信息
     print(f"\n✅ Analyze finished successfully!")
     print(f"📋 Please check the log: {args.log_file}")
-    print(f"🔍 Please check for the dependence of struct [{args.cls}]: {args.output[:-5]+"_dependence.json"}")
+    print(f"🔍 Please check for the dependence of struct [{args.cls}]: {args.output[:-5]+'_dependence.json'}")
     print(f"🔍 Please check for the analyze result for struct [{args.cls}]: {args.output}")
     print("="*80)
 
 
-if __name__ == "__main__":
+def flatten_members(result, dependence=None):
+    """
+    Flatten the analyzed tree of a root class into one record per leaf member
+
+    Class members are expanded recursively, pointers and containers are not expanded since
+    they are not stored inline. `cached` references are resolved through `dependence`.
+
+    Args:
+        result: dict, the analyze result of the root class (content of `_analyze.json`)
+        dependence: TypeDetailCache, the dependent types (content of `_dependence.json`), default `None`
+
+    Returns:
+        list: dicts with the keys of `FLAT_COLUMNS`, `byte_offset` is the offset from the root class
+              or `None` when unknown; `is_static` / `is_bitfield` come from the member itself, members
+              of a static member or of a bit field are flagged too, since they are outside the object layout
+              or have no exact offset
+    """
+    records = []
+
+    def walk(node, path, offset, flags, visiting):
+        flags = {
+            "is_static": flags["is_static"] or bool(node.get("is_static")),
+            "is_bitfield": flags["is_bitfield"] or bool(node.get("is_bitfield"))
+        }
+        body = node
+        if node.get("cached") != None and dependence != None:
+            body = dependence.get_type_cache(node.get("cache_k")) or node
+        variables = body.get("variables")
+        if body.get("is_class") and not body.get("is_container") and variables and body.get("type") not in visiting:
+            for var in variables:
+                _offset = offset + var["byte_offset"] if offset != None and var.get("byte_offset") != None else None
+                walk(var, path + [var["name"]], _offset, flags, visiting | {body.get("type")})
+            return
+        records.append({
+            "path": ".".join(path),
+            # `cached` references carry `decl_type` only, it is the type when `dependence` can not resolve them
+            "type": body.get("type") or node.get("type") or node.get("decl_type"),
+            "is_fundamental": bool(body.get("is_fundamental")),
+            "is_enum": bool(body.get("is_enum")),
+            "is_pointer": bool(body.get("is_pointer")),
+            "is_container": bool(body.get("is_container")),
+            "is_static": flags["is_static"],
+            "is_bitfield": flags["is_bitfield"],
+            "byte_offset": offset
+        })
+
+    walk(result, [], 0, {"is_static": False, "is_bitfield": False}, frozenset())
+    return records
+
+
+def export_flat(records, output):
+    """
+    Write the records of `flatten_members()` as a TSV file, or a NumPy structured array when `output` ends with `.npy`
+    Unknown `byte_offset` is written as an empty field in TSV and `-1` in `.npy`
+    """
+    if output.endswith(".npy"):
+        try:
+            import numpy
+        except ImportError:
+            raise RuntimeError("numpy is required to export {}, or use a .tsv output".format(output))
+        dtype = [
+            ("path", "U{}".format(max([len(r["path"]) for r in records] + [1]))),
+            ("type", "U{}".format(max([len(r["type"]) for r in records] + [1])))
+        ] + [(c, "?") for c in FLAT_COLUMNS[2:-1]] + [("byte_offset", "i8")]
+        rows = [tuple(-1 if r[c] == None and c == "byte_offset" else r[c] for c in FLAT_COLUMNS) for r in records]
+        numpy.save(output, numpy.array(rows, dtype=dtype))
+        return
+    with open(output, "w") as f:
+        f.write("\t".join(FLAT_COLUMNS) + "\n")
+        for r in records:
+            f.write("\t".join([r["path"], r["type"]] + [str(int(r[c])) for c in FLAT_COLUMNS[2:-1]]
+                               + ["" if r["byte_offset"] == None else str(r["byte_offset"])]) + "\n")
+
+
+def diff_json(old, new, path=""):
+    """
+    Compare two analysis outputs recursively
+
+    Args:
+        old: value loaded from the first json file
+        new: value loaded from the second json file
+        path: dotted path of the current value, used as prefix of the report
+
+    Returns:
+        list: lines like `- path`, `+ path` or `~ path: old -> new`
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        res = []
+        for k in sorted(set(old) | set(new), key=str):
+            _path = "{}.{}".format(path, k) if path else str(k)
+            if k not in new:
+                res.append("- {}".format(_path))
+            elif k not in old:
+                res.append("+ {}".format(_path))
+            else:
+                res.extend(diff_json(old[k], new[k], _path))
+        return res
+    if isinstance(old, list) and isinstance(new, list):
+        res = []
+        for i in range(max(len(old), len(new))):
+            _path = "{}[{}]".format(path, i)
+            if i >= len(new):
+                res.append("- {}".format(_path))
+            elif i >= len(old):
+                res.append("+ {}".format(_path))
+            else:
+                res.extend(diff_json(old[i], new[i], _path))
+        return res
+    if old != new:
+        return ["~ {}: {} -> {}".format(path, json.dumps(old), json.dumps(new))]
+    return []
+
+
+def build_args_parser():
     args_parser = argparse.ArgumentParser(description='Analyze CPP struct/class, generate json detail.')
-    args_parser.add_argument('--input', dest='input', required=False, default="../../My_Repository.h",
+    subparsers = args_parser.add_subparsers(dest='command', metavar='{' + ','.join(SUBCOMMANDS) + '}',
+                        help='`analyze` is used when no subcommand is given')
+
+    analyze_parser = subparsers.add_parser('analyze', help='parse the header and analyze a class/struct (needs pygccxml/CastXML)')
+    analyze_parser.add_argument('--input', dest='input', required=False, default="../../My_Repository.h",
                         help='the path of the cpp header file')
-    args_parser.add_argument('--class', dest='cls', required=False, default="MyClass",
+    analyze_parser.add_argument('--class', dest='cls', required=False, default="MyClass",
                         help='the name of class/struct name which need to be analyzed')
-    args_parser.add_argument('--output', dest='output', required=False, default="TODO.json",
+    analyze_parser.add_argument('--output', dest='output', required=False, default="TODO.json",
                         help='the path of the json result')
-    args_parser.add_argument('--cflags', dest='cflags', required=False, default='-std=c++11 -I. -I/usr/local/include -O0 -Wall')
-    args_parser.add_argument('--sort_keys', dest='sort_keys', action='store_true', default=False,
+    analyze_parser.add_argument('--cflags', dest='cflags', required=False, default='-std=c++11 -I. -I/usr/local/include -O0 -Wall')
+    analyze_parser.add_argument('--sort_keys', dest='sort_keys', action='store_true', default=False,
                         help='sort the json keys when dump to file')
-    args_parser.add_argument('--log_file', dest='log_file', required=False, default="./debug.log",
+    analyze_parser.add_argument('--log_file', dest='log_file', required=False, default="./debug.log",
                         help='the path of the log file')
-    args_parser.add_argument('--only_public_var', dest='only_public_var', action='store_true', default=False,
+    analyze_parser.add_argument('--only_public_var', dest='only_public_var', action='store_true', default=False,
                         help='only analyze the public variables of a class/struct')
-    args_parser.add_argument('--file_path_black_list', dest='file_path_black_list', nargs='+', default=[],
-                        help='the file path black list, the class/struct which is declared in the file under the paths will be ignored, such as xxx/xxx/3rd')
-    args = args_parser.parse_args()
+    analyze_parser.add_argument('--file_path_black_list', dest='file_path_black_list', nargs='+', default=[],
+                        help='the file path black list, the class/struct which is declared in the file under the paths will be ignored, such as xxx/xxx/3rd, glob is supported, such as /usr/*')
+    analyze_parser.add_argument('--skip_namespaces', dest='skip_namespaces', nargs='+', default=[],
+                        help='the namespaces skipped besides std, tsl and mstd, glob is supported, such as boost absl folly "ns::*detail*"')
+    analyze_parser.add_argument('--skip_types', dest='skip_types', nargs='+', default=[],
+                        help='the type names which will be skipped, glob is supported, such as "*_impl"')
+    analyze_parser.add_argument('--memory_budget', dest='memory_budget', type=float, required=False, default=None,
+                        help='the memory budget (MB) of the type cache, finished cold entries are spilled to disk (LRU) and reloaded on access, the json outputs are unchanged')
+    analyze_parser.add_argument('--drop_decls', dest='drop_decls', action='store_true', default=False,
+                        help='release the member declarations of each class once it is analyzed, and all pygccxml declarations after the analysis, to lower the peak memory')
+    analyze_parser.add_argument('--flat_output', dest='flat_output', required=False, default=None,
+                        help='also export the flattened member paths of the class, as TSV or as NumPy structured array when ending with `.npy`')
+
+    query_parser = subparsers.add_parser('query', help='look up types in a persisted `_dependence.json` / `_analyze.json`, no parsing')
+    query_parser.add_argument('--cache', dest='cache', required=True,
+                        help='the `_dependence.json` or `_analyze.json` written by a previous analyze')
+    query_parser.add_argument('types', nargs='+',
+                        help='the type names to look up, leading `::` is ignored')
+    query_parser.add_argument('--sort_keys', dest='sort_keys', action='store_true', default=False,
+                        help='sort the json keys when print')
 
+    diff_parser = subparsers.add_parser('diff', help='compare two json outputs, exit code is 1 when they differ')
+    diff_parser.add_argument('old', help='the path of the first json file')
+    diff_parser.add_argument('new', help='the path of the second json file')
+
+    flatten_parser = subparsers.add_parser('flatten', help='export one record per leaf member of a previous `_analyze.json`, no parsing')
+    flatten_parser.add_argument('--input', dest='input', required=True,
+                        help='the `_analyze.json` written by a previous analyze')
+    flatten_parser.add_argument('--dependence', dest='dependence', required=False, default=None,
+                        help='the `_dependence.json` to resolve cached types, default is the one next to `--input`')
+    flatten_parser.add_argument('--output', dest='output', required=False, default=None,
+                        help='the path of the TSV, or of the NumPy structured array when ending with `.npy`, default `<input>_flat.tsv`')
+    return args_parser
+
+
+def run_analyze(args):
     if args.output == "TODO.json":
         args.output = args.cls + "_analyze.json"
     
@@ -752,10 +1431,77 @@ if __name__ == "__main__":
     logging.debug("clang_flag = %s", args.cflags)
 
     start_time = time.time()
-    analyzer = CppStructClassAnalyzer(only_public_var=args.only_public_var, file_path_black_list=args.file_path_black_list)
+    memory_budget = None if args.memory_budget == None else int(args.memory_budget * 1024 * 1024)
+    analyzer = CppStructClassAnalyzer(only_public_var=args.only_public_var, file_path_black_list=args.file_path_black_list,
+                                      memory_budget=memory_budget, drop_decls=args.drop_decls,
+                                      skip_namespaces=args.skip_namespaces, skip_types=args.skip_types)
     analyzer.start_analyze(args.input, clang_flag, args.cls, output=args.output, sort_keys=args.sort_keys)
+    if args.flat_output:
+        export_flat(flatten_members(analyzer.res, analyzer.cache_), args.flat_output)
     total_time = time.time() - start_time
 
     # 输出总结信息
     print_analysis_summary(analyzer, args, total_time)
+    return 0
 
+
+def run_query(args):
+    cache = CppStructClassAnalyzer.TypeDetailCache()
+    cache.load_cache_info(args.cache)
+    ret = 0
+    for t in args.types:
+        res = cache.get_type_cache(t)
+        if res == None:
+            print("cannot find type {} in {}".format(t, args.cache), file=sys.stderr)
+            ret = 1
+            continue
+        print(json.dumps({t: res}, indent=4, sort_keys=args.sort_keys))
+    return ret
+
+
+def run_diff(args):
+    with open(args.old, "r") as f:
+        old = json.load(f)
+    with open(args.new, "r") as f:
+        new = json.load(f)
+    lines = diff_json(old, new)
+    for line in lines:
+        print(line)
+    return 1 if lines else 0
+
+
+def run_flatten(args):
+    with open(args.input, "r") as f:
+        result = json.load(f)
+    dependence = CppStructClassAnalyzer.TypeDetailCache()
+    dependence_path = args.dependence or args.input[:-5] + "_dependence.json"
+    if os.path.exists(dependence_path):
+        dependence.load_cache_info(dependence_path)
+    elif args.dependence:
+        print("cannot find dependence file {}".format(args.dependence), file=sys.stderr)
+        return 1
+    else:
+        # without the dependence file, `cached` references stay unexpanded leaves
+        print("cannot find {}, cached types are not expanded".format(dependence_path), file=sys.stderr)
+    records = flatten_members(result, dependence)
+    export_flat(records, args.output or args.input[:-5] + "_flat.tsv")
+    return 0
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    # keep the old style `structure_analyzer.py --input xx --class xx` working
+    if not argv or (argv[0] not in SUBCOMMANDS and argv[0] not in ("-h", "--help")):
+        argv = ["analyze"] + argv
+    args = build_args_parser().parse_args(argv)
+    if args.command == "query":
+        return run_query(args)
+    if args.command == "diff":
+        return run_diff(args)
+    if args.command == "flatten":
+        return run_flatten(args)
+    return run_analyze(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
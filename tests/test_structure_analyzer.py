@@ -0,0 +1,323 @@
+import collections
+import importlib.util
+import json
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+import structure_analyzer  # noqa: E402
+from structure_analyzer import CppStructClassAnalyzer, flatten_members, export_flat, FLAT_COLUMNS  # noqa: E402
+
+
+def build_namespace():
+    """
+    Build a declaration tree without CastXML:
+        struct B   { double y; A *back; static int count; };
+        struct A   { int x; B b; B *pb; unsigned flag : 1; };
+        struct Foo { A a; B b; int n; };
+    """
+    declarations = pytest.importorskip("pygccxml.declarations")
+    global_ns = declarations.namespace_t("::")
+    app = declarations.namespace_t("app")
+    global_ns.adopt_declaration(app)
+    classes = {}
+    for name in ["A", "B", "Foo"]:
+        classes[name] = declarations.class_t(name)
+        app.adopt_declaration(classes[name])
+
+    def var(cls, name, decl_type, offset=0, static=False, bits=None):
+        qualifiers = declarations.type_qualifiers_t(has_static=static)
+        v = declarations.variable_t(name, decl_type, type_qualifiers=qualifiers, bits=bits)
+        v.byte_offset = offset
+        classes[cls].adopt_declaration(v, declarations.ACCESS_TYPES.PUBLIC)
+
+    decl = lambda name: declarations.declarated_t(classes[name])
+    var("B", "y", declarations.double_t(), 0)
+    var("B", "back", declarations.pointer_t(decl("A")), 8)
+    var("B", "count", declarations.int_t(), static=True)
+    var("A", "x", declarations.int_t(), 0)
+    var("A", "b", decl("B"), 8)
+    var("A", "pb", declarations.pointer_t(decl("B")), 24)
+    var("A", "flag", declarations.unsigned_int_t(), 32, bits=1)
+    var("Foo", "a", decl("A"), 0)
+    var("Foo", "b", decl("B"), 40)
+    var("Foo", "n", declarations.int_t(), 56)
+    return global_ns
+
+
+def make_analyzer(**kwargs):
+    global_ns = build_namespace()
+    analyzer = CppStructClassAnalyzer(**kwargs)
+    analyzer.global_ns_ = global_ns
+    return analyzer
+
+
+def test_flatten_resolves_cached_members_and_offsets():
+    b = {"type": "B", "decl_type": "B", "name": "b", "is_class": True, "byte_offset": 8, "variables": [
+        {"name": "y", "type": "int", "decl_type": "int", "is_fundamental": True, "byte_offset": 4},
+        {"name": "count", "type": "int", "decl_type": "int", "is_fundamental": True, "is_static": True},
+    ]}
+    root = {"type": "A", "decl_type": "A", "is_class": True, "variables": [
+        {"name": "x", "type": "int", "decl_type": "int", "is_fundamental": True, "byte_offset": 0},
+        b,
+        {"name": "b2", "decl_type": "B", "cached": "Done", "cache_k": "B", "byte_offset": 16},
+        {"name": "p", "type": "B *", "decl_type": "B *", "is_pointer": True, "byte_offset": 24},
+    ]}
+    dependence = CppStructClassAnalyzer.TypeDetailCache()
+    dependence.add_type_cache("B", b)
+
+    records = {r["path"]: r for r in flatten_members(root, dependence)}
+    assert list(records) == ["x", "b.y", "b.count", "b2.y", "b2.count", "p"]
+    assert records["b.y"]["byte_offset"] == 12
+    assert records["b2.y"]["byte_offset"] == 20
+    assert records["b2.count"]["is_static"] and records["b2.count"]["byte_offset"] == None
+    assert records["p"]["is_pointer"] and not records["p"]["is_static"]
+
+
+def test_export_flat_tsv(tmp_path):
+    records = [
+        {"path": "a.x", "type": "int", "is_fundamental": True, "is_enum": False, "is_pointer": False,
+         "is_container": False, "is_static": False, "is_bitfield": False, "byte_offset": 4},
+        {"path": "a.n", "type": "int", "is_fundamental": True, "is_enum": False, "is_pointer": False,
+         "is_container": False, "is_static": True, "is_bitfield": False, "byte_offset": None},
+    ]
+    output = str(tmp_path / "flat.tsv")
+    export_flat(records, output)
+    lines = open(output).read().splitlines()
+    assert lines == [
+        "\t".join(FLAT_COLUMNS),
+        "a.x\tint\t1\t0\t0\t0\t0\t0\t4",
+        "a.n\tint\t1\t0\t0\t0\t1\t0\t",
+    ]
+
+
+def test_flatten_without_dependence_file(tmp_path):
+    input = tmp_path / "A_analyze.json"
+    input.write_text(json.dumps({"type": "A", "decl_type": "A", "is_class": True, "variables": [
+        {"name": "x", "type": "int", "decl_type": "int", "is_fundamental": True, "byte_offset": 0},
+        {"name": "b", "decl_type": "B", "cached": "Done", "cache_k": "B", "byte_offset": 8}]}))
+    assert structure_analyzer.main(["flatten", "--input", str(input)]) == 0
+    lines = (tmp_path / "A_analyze_flat.tsv").read_text().splitlines()
+    assert lines[1:] == ["x\tint\t1\t0\t0\t0\t0\t0\t0", "b\tB\t0\t0\t0\t0\t0\t0\t8"]
+    if importlib.util.find_spec("numpy") != None:
+        assert structure_analyzer.main(["flatten", "--input", str(input), "--output", str(tmp_path / "flat.npy")]) == 0
+    assert structure_analyzer.main(["flatten", "--input", str(input), "--dependence", str(tmp_path / "missing.json")]) == 1
+
+
+def test_typedefs_resolve_through_pruned_namespaces(monkeypatch):
+    declarations = pytest.importorskip("pygccxml.declarations")
+    # namespace std { class basic_string<char>; typedef basic_string<char> string; }  typedef std::string MyStr;
+    global_ns = build_namespace()
+    std = declarations.namespace_t("std")
+    global_ns.adopt_declaration(std)
+    basic_string = declarations.class_t("basic_string<char>")
+    std.adopt_declaration(basic_string)
+    std.adopt_declaration(declarations.typedef_t("string", declarations.declarated_t(basic_string)))
+    global_ns.namespace("app").adopt_declaration(declarations.typedef_t("MyStr", declarations.declarated_t(std.typedefs("string")[0])))
+
+    analyzer = CppStructClassAnalyzer()
+    monkeypatch.setattr(structure_analyzer.utils, "find_xml_generator", lambda name: ("castxml", "castxml"))
+    monkeypatch.setattr(structure_analyzer.parser, "parse", lambda files, config, mode: [global_ns])
+    analyzer.parse_global_namespace("test.h", "")
+    assert "std" not in [ns.name for ns in analyzer.global_ns_.namespaces(allow_empty=True)]
+    res = analyzer.analyze_string_typedef("app::MyStr")
+    assert res["typedef_type"] == "std::basic_string<char>"
+
+
+def test_member_layout_is_not_cached():
+    analyzer = make_analyzer()
+    analyzer.start_analyze("test.h", "", "Foo")
+    members = {v["name"]: v for v in analyzer.res["variables"]}
+    assert members["n"]["byte_offset"] == 56
+    assert members["b"]["byte_offset"] == 40
+    # the type cache is shared by all members of a type, it must not carry the offset of one of them
+    for k, v in analyzer.cache_.type_detail_cache_.items():
+        assert not set(v) & set(structure_analyzer.MEMBER_LAYOUT_KEYS), k
+
+    records = {r["path"]: r for r in flatten_members(analyzer.res, analyzer.cache_)}
+    assert records["a.b.y"]["byte_offset"] == 8
+    assert records["b.y"]["byte_offset"] == 40
+    assert records["a.flag"]["is_bitfield"] and records["a.flag"]["byte_offset"] == None
+    assert records["b.count"]["is_static"] and records["b.count"]["byte_offset"] == None
+
+
+@pytest.mark.parametrize("sort_keys", [False, True])
+def test_memory_budget_keeps_output_format(tmp_path, sort_keys):
+    outputs = {}
+    for budget in [None, 64]:
+        analyzer = make_analyzer(memory_budget=budget)
+        output = str(tmp_path / "{}_analyze.json".format(budget))
+        analyzer.start_analyze("test.h", "", "Foo", output=output, sort_keys=sort_keys)
+        outputs[budget] = (open(output).read(), open(output[:-5] + "_dependence.json").read())
+        if budget != None:
+            assert len(analyzer.cache_.spilled_) > 0
+            assert "Detached" not in outputs[budget][0] + outputs[budget][1]
+    assert outputs[None] == outputs[64]
+
+
+def test_memory_budget_does_not_load_spilled_entries_to_claim(monkeypatch):
+    analyzer = make_analyzer(memory_budget=64)
+    loads = []
+    load = CppStructClassAnalyzer.TypeDetailCache._load
+    monkeypatch.setattr(CppStructClassAnalyzer.TypeDetailCache, "_load", lambda self, k: loads.append(k) or load(self, k))
+    analyzer.start_analyze("test.h", "", "Foo")
+    assert len(analyzer.cache_.spilled_) > 0
+    # only the root result is read back, the members spilled before are answered as done from the index
+    assert loads in ([], ["Foo"])
+
+
+def test_drop_decls_releases_analyzed_classes():
+    declarations = pytest.importorskip("pygccxml.declarations")
+    results = {}
+    for drop_decls in [False, True]:
+        analyzer = make_analyzer(drop_decls=drop_decls)
+        app = analyzer.global_ns_.namespace("app")
+        # struct Bar { B b; BAlias c; }: `c` reaches B again through a typedef, after B has been released
+        alias = declarations.typedef_t("BAlias", declarations.declarated_t(app.class_("B")))
+        bar = declarations.class_t("Bar")
+        app.adopt_declaration(alias)
+        app.adopt_declaration(bar)
+        for name, decl_type in [("b", declarations.declarated_t(app.class_("B"))), ("c", declarations.declarated_t(alias))]:
+            v = declarations.variable_t(name, decl_type, type_qualifiers=declarations.type_qualifiers_t())
+            v.byte_offset = 0
+            bar.adopt_declaration(v, declarations.ACCESS_TYPES.PUBLIC)
+        analyzer.start_analyze("test.h", "", "app::Bar")
+        results[drop_decls] = analyzer.res
+        if drop_decls:
+            # every analyzed class is gone before the end of the walk, only the typedef is left
+            assert [d.name for d in app.declarations] == ["Foo", "BAlias"]
+            assert analyzer.global_ns_ == None
+    assert results[True] == results[False]
+    members = {v["name"]: v for v in results[True]["variables"]}
+    assert {v["name"] for v in members["c"]["variables"]} == {"y", "back", "count"}
+
+
+def run_threads(targets, timeout=10):
+    threads = [threading.Thread(target=t) for t in targets]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout)
+    assert not any(t.is_alive() for t in threads), "analyze() deadlocked"
+
+
+def test_analyze_repeated_returns_full_result():
+    analyzer = make_analyzer()
+    first, costs = analyzer.analyze("test.h", "", "Foo")
+    second, _ = analyzer.analyze("test.h", "", "Foo")
+    assert "cached" not in first and len(first["variables"]) == 3
+    assert second == first
+    # the result belongs to the caller, changing it does not change the cached type
+    first["variables"].clear()
+    third, _ = analyzer.analyze("test.h", "", "Foo")
+    assert third == second
+    assert set(costs) == {"find_class_cost", "not_find_class_cost", "find_typedef_cost", "find_enum_cost"}
+
+
+def test_analyze_concurrent_requests_are_coalesced(monkeypatch):
+    analyzer = make_analyzer()
+    calls = collections.Counter()
+    find_class = CppStructClassAnalyzer.find_class
+
+    def slow_find_class(self, cls_name):
+        calls[cls_name] += 1
+        time.sleep(0.05)
+        return find_class(self, cls_name)
+
+    monkeypatch.setattr(CppStructClassAnalyzer, "find_class", slow_find_class)
+    barrier = threading.Barrier(3)
+    results = []
+
+    def request():
+        barrier.wait()
+        results.append(analyzer.analyze("test.h", "", "Foo")[0])
+
+    run_threads([request] * 3)
+    assert len(results) == 3
+    for res in results:
+        assert "cached" not in res and len(res["variables"]) == 3
+    # every class is looked up by one request only
+    assert max(calls.values()) == 1
+
+
+def test_analyze_cross_request_cycle_does_not_deadlock(monkeypatch):
+    # request 1 holds A and needs B (member `b`), request 2 holds B and needs A (member `back`)
+    analyzer = make_analyzer()
+    a_claimed = threading.Event()
+    find_class = CppStructClassAnalyzer.find_class
+
+    def slow_find_class(self, cls_name):
+        if cls_name == "app::A":
+            a_claimed.set()
+            time.sleep(0.2)
+        return find_class(self, cls_name)
+
+    monkeypatch.setattr(CppStructClassAnalyzer, "find_class", slow_find_class)
+    results = {}
+
+    def request_a():
+        results["A"] = analyzer.analyze("test.h", "", "app::A")[0]
+
+    def request_b():
+        a_claimed.wait(5)
+        results["B"] = analyzer.analyze("test.h", "", "app::B")[0]
+
+    run_threads([request_a, request_b])
+    members = {v["name"]: v for v in results["A"]["variables"]}
+    # waiting for B would close the cycle, so request 1 reports it as in process
+    assert members["b"]["cached"] == "InProcess"
+    b = analyzer.resolve(members["b"])
+    assert b["name"] == "b" and b["byte_offset"] == 8
+    assert {v["name"] for v in b["variables"]} == {"y", "back", "count"}
+    assert {v["name"] for v in results["B"]["variables"]} == {"y", "back", "count"}
+    assert analyzer.cache_.owners_ == {} and analyzer.cache_.waiting_ == {}
+
+
+@pytest.mark.parametrize("budget", [None, 64])
+def test_resolve_cached_members(budget):
+    analyzer = make_analyzer(memory_budget=budget)
+    analyzer.analyze("test.h", "", "app::B")
+    res, _ = analyzer.analyze("test.h", "", "Foo")
+    members = {v["name"]: v for v in res["variables"]}
+    assert members["b"]["cached"] in ("Done", "Detached")
+    b = analyzer.resolve(members["b"])
+    assert "cached" not in b and b["name"] == "b" and b["byte_offset"] == 40
+    assert {v["name"] for v in b["variables"]} == {"y", "back", "count"}
+    assert analyzer.resolve(res) is res
+    b["variables"].clear()
+    assert len(analyzer.resolve(members["b"])["variables"]) == 3
+
+
+def test_failed_request_releases_placeholders(monkeypatch):
+    analyzer = make_analyzer()
+    analyze_string_class = CppStructClassAnalyzer.analyze_string_class
+
+    def failing(self, cls_name):
+        if cls_name == "app::B":
+            raise RuntimeError("transient failure")
+        return analyze_string_class(self, cls_name)
+
+    monkeypatch.setattr(CppStructClassAnalyzer, "analyze_string_class", failing)
+    with pytest.raises(RuntimeError):
+        analyzer.analyze("test.h", "", "Foo")
+    assert {} not in analyzer.cache_.type_detail_cache_.values()
+
+    monkeypatch.setattr(CppStructClassAnalyzer, "analyze_string_class", analyze_string_class)
+    res, _ = analyzer.analyze("test.h", "", "Foo")
+    members = {v["name"]: v for v in res["variables"]}
+    assert "cached" not in res and "cached" not in members["a"]
+    assert {v["name"] for v in members["a"]["variables"]} == {"x", "b", "pb", "flag"}
+
+
+def test_analyze_other_header_raises():
+    analyzer = make_analyzer()
+    analyzer.analyze("test.h", "", "Foo")
+    with pytest.raises(ValueError):
+        analyzer.analyze("other.h", "", "Foo")
+    with pytest.raises(ValueError):
+        analyzer.analyze("test.h", "-std=c++17", "Foo")